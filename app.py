@@ -1,13 +1,34 @@
-import os, json, re, requests, time, uuid
+import os, re, requests, secrets, threading, time
 from datetime import timedelta
-from flask import Flask, render_template, request, session, redirect, url_for, flash
+from flask import (Flask, Response, render_template, request, session, redirect, url_for, flash,
+                   stream_with_context, g)
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.middleware.proxy_fix import ProxyFix
 from dotenv import load_dotenv
+from cachetools import TTLCache, cached
+from parsing import parse_json_safe  # compiled with mypyc when built
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import stripe
+import redis
+import orjson
 
 load_dotenv()  # load .env locally
 
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON (incl. the session cookie serializer) backed by orjson."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # --- App setup ---
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
+# Behind one proxy (Render/Heroku): take client IP and scheme from X-Forwarded-*
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1)
 app.secret_key = os.environ.get("SECRET_KEY", os.urandom(24))
 app.permanent_session_lifetime = timedelta(days=180)
 
@@ -24,20 +45,54 @@ FREE_DAILY      = int(os.environ.get("FREE_DAILY", "5"))
 STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY", "")
 STRIPE_PRICE_ID   = os.environ.get("STRIPE_PRICE_ID", "")
 BASE_URL          = os.environ.get("BASE_URL", "http://localhost:10000")
+# Signing secret for /stripe/webhook (checkout.session.completed)
+STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET", "")
 
 # Optional fallbacks
 STRIPE_LINK    = os.environ.get("STRIPE_LINK", "")
 ADMIN_PRO_CODE = os.environ.get("ADMIN_PRO_CODE", "")
 
+# Shared quota store (recommended with >1 worker); in-memory when unset
+REDIS_URL = os.environ.get("REDIS_URL", "")
+
 if not OPENAI_API_KEY:
     raise RuntimeError("Set OPENAI_API_KEY in environment.")
 
 if STRIPE_SECRET_KEY:
     stripe.api_key = STRIPE_SECRET_KEY
 
+redis_client = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL else None
+
+# --- HTTP ---
+# One pooled, keep-alive session for OpenAI and Stripe calls so routes reuse
+# TCP+TLS connections instead of handshaking on every request.
+OPENAI_URL = "https://api.openai.com/v1/chat/completions"
+OPENAI_HEADERS = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+
+SESSION = requests.Session()
+SESSION.mount("https://api.openai.com/", HTTPAdapter(
+    pool_connections=32,
+    pool_maxsize=64,
+    # Retry connect errors and 429/5xx only. read=0: a timed-out POST may still be
+    # generating (and billing) upstream, and replays would outlast gunicorn's timeout.
+    max_retries=Retry(total=2, read=0, backoff_factor=0.2,
+                      status_forcelist=[429, 500, 502, 503, 504],
+                      allowed_methods=frozenset({"POST"}),
+                      respect_retry_after_header=False,
+                      raise_on_status=False),
+))
+# No adapter-level retries for Stripe: a replayed POST could create a second
+# checkout session. The SDK handles its own (idempotent) retries.
+SESSION.mount("https://api.stripe.com/", HTTPAdapter(pool_connections=8, pool_maxsize=32))
+
+# Route the Stripe SDK through the shared pool instead of its per-thread sessions
+stripe.default_http_client = stripe.RequestsClient(timeout=30, session=SESSION)
+
 # --- Game config ---
-CATEGORIES = ["Trigger", "Coping", "Healing", "Wild"]
-TONES = ["Classic", "Sassy", "Spicy", "Extra Spicy"]
+CATEGORIES = ("Trigger", "Coping", "Healing", "Wild")
+TONES = ("Classic", "Sassy", "Spicy", "Extra Spicy")
+CATEGORIES_SET = frozenset(CATEGORIES)  # membership checks
+TONES_SET = frozenset(TONES)
 TONE_GUIDE = {
     "Classic": "balanced, gently witty, broadly appealing",
     "Sassy": "campy, flirtatious, bold quips, playful shade",
@@ -45,6 +100,10 @@ TONE_GUIDE = {
     "Extra Spicy": "max sass and innuendo; toe the PG-13 line without crossing it",
 }
 
+# Resolved once; render_template still adds session/flash context per request
+INDEX_TEMPLATE = app.jinja_env.get_template("index.html")
+INDEX_CTX = {"categories": CATEGORIES, "tones": TONES, "stripe": bool(STRIPE_PRICE_ID or STRIPE_LINK)}
+
 # --- Prompting ---
 SAFETY_RAILS = (
     "Keep it PG-13. No slurs, hate, graphic violence, explicit sexual content, "
@@ -59,7 +118,7 @@ VOICE: Samantha Jones meets a drag show emcee — witty, camp, irreverent, flirt
 sharp one-liners; a little savage but ultimately kind. Embrace double entendre and theatrical flair.
 Never punch down. Keep it cathartic and empowering.
 
-Each card must be STRICT JSON with keys:
+Each card must be STRICT JSON with keys, in this order:
 - title (≤ 8 words)
 - subtitle (≤ 14 words)
 - body (≤ 80 words)
@@ -70,142 +129,276 @@ Tone: darkly comedic + empathetic + clever. {SAFETY_RAILS}
 Output JSON only. No commentary, no backticks.
 """
 
+SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
 # -------------------------- OPENAI --------------------------
 
-def call_openai(category: str, theme: str, tone: str = "Sassy") -> dict:
-    """Call OpenAI Chat Completions for one card with a tone knob."""
-    url = "https://api.openai.com/v1/chat/completions"
-    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}", "Content-Type": "application/json"}
+# Everything before the user message's content is the same on every call
+# (including the ~1 KB system prompt), so it is JSON-encoded once at import.
+_PAYLOAD_HEAD = orjson.dumps({
+    "model": "gpt-4o-mini",
+    "temperature": 1.0,
+    "max_tokens": 300,
+    "response_format": {"type": "json_object"},
+    "messages": [SYSTEM_MSG, {"role": "user", "content": ""}],
+})[:-len(b'""}]}')]
+
+def encode_payload(category: str, theme: str, tone: str = "Sassy", stream: bool = False) -> bytes:
+    """Chat Completions request body for one card prompt, as JSON bytes."""
     tone_desc = TONE_GUIDE.get(tone, TONE_GUIDE["Sassy"])
     user_prompt = (
         f"Create one {category} card. Target tone: {tone} ({tone_desc})."
         + (f" Theme: {theme.strip()}." if theme and theme.strip() else "")
         + " Keep it original and on-brand. Return strict JSON only."
     )
-    payload = {
-        "model": "gpt-4o-mini",
-        "messages": [
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": user_prompt}
-        ],
-        "temperature": 1.0,
-        "max_tokens": 300,
-    }
-    r = requests.post(url, headers=headers, json=payload, timeout=30)
+    body = _PAYLOAD_HEAD + orjson.dumps(user_prompt) + b"}]"
+    if stream:
+        body += b',"stream":true'
+    return body + b"}"
+
+def call_openai(category: str, theme: str, tone: str = "Sassy") -> dict:
+    """Call OpenAI Chat Completions for one card with a tone knob."""
+    r = SESSION.post(OPENAI_URL, headers=OPENAI_HEADERS,
+                     data=encode_payload(category, theme, tone), timeout=(5, 30))
     r.raise_for_status()
-    text = r.json()["choices"][0]["message"]["content"].strip()
+    text = orjson.loads(r.content)["choices"][0]["message"]["content"]
     return parse_json_safe(text)
 
-def parse_json_safe(text: str) -> dict:
-    """Extract first JSON object from text safely."""
-    text = text.strip()
-    text = re.sub(r"^```(?:json)?|```$", "", text).strip()
-    match = re.search(r"\{.*\}", text, flags=re.DOTALL)
-    if not match:
-        return {"title": "Card Error", "subtitle": "Parsing issue",
-                "body": "We couldn't parse the AI response as JSON. Try again.",
-                "category": "Trigger", "tags": ["error"]}
-    try:
-        data = json.loads(match.group(0))
-        data.setdefault("category", "Trigger")
-        data.setdefault("tags", [])
-        for k in ["title", "subtitle", "body"]:
-            data.setdefault(k, "")
-        return data
-    except Exception:
-        return {"title": "Card Error", "subtitle": "JSON decode failed",
-                "body": "The response wasn't valid JSON. Try again.",
-                "category": "Trigger", "tags": ["error"]}
+# A top-level string field whose closing quote has arrived
+_FIELD_RE = re.compile(r'"(title|subtitle|body|category)"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+def stream_card(category: str, theme: str, tone: str = "Sassy"):
+    """
+    Stream one card from OpenAI. Yields ("field", {name: value}) as each string
+    field completes, then ("card", card) once the whole reply has arrived.
+    """
+    with SESSION.post(OPENAI_URL, headers=OPENAI_HEADERS,
+                      data=encode_payload(category, theme, tone, stream=True),
+                      timeout=(5, 30), stream=True) as r:
+        r.raise_for_status()
+        buf = ""
+        sent = set()
+        for line in r.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            data = line[6:]
+            if data == b"[DONE]":
+                break
+            choices = orjson.loads(data)["choices"]
+            delta = (choices[0]["delta"].get("content") or "") if choices else ""
+            buf += delta
+            if '"' not in delta:
+                continue  # no string can have just closed
+            for m in _FIELD_RE.finditer(buf):
+                name = m.group(1)
+                if name not in sent:
+                    sent.add(name)
+                    yield "field", {name: orjson.loads(f'"{m.group(2)}"')}
+    yield "card", parse_json_safe(buf)
 
 # -------------------------- FREE QUOTA (per email/IP) --------------------------
 
-# In-memory usage store: { (key_id, 'YYYY-MM-DD'): int_count }
+# Usage counts live in Redis when REDIS_URL is set, so every worker sees the
+# same count and old days expire on their own:  q:<key_id>:<YYYY-MM-DD> -> int
+USAGE_TTL = 2 * 24 * 3600
+
+# In-memory fallback: { 'YYYY-MM-DD': { key_id: int_count } }
+# Only today's counts are kept; the first write of a new day drops the rest.
 USAGE = {}
+USAGE_LOCK = threading.Lock()
 
 def _today() -> str:
-    return time.strftime("%Y-%m-%d")
+    """UTC date, computed once per request."""
+    d = getattr(g, "_today", None)
+    if d is None:
+        d = g._today = time.strftime("%Y-%m-%d", time.gmtime())
+    return d
 
 def usage_key() -> str:
     """
     Stable key for free quota:
       - signed-in users: their email
-      - anonymous users: their IP (from X-Forwarded-For or remote_addr)
+      - anonymous users: their IP (remote_addr, resolved by ProxyFix)
     """
     if session.get("email"):
         return f"email:{session['email'].lower()}"
-    ip = request.headers.get("X-Forwarded-For", request.remote_addr or "0.0.0.0").split(",")[0].strip()
-    return f"ip:{ip}"
+    return f"ip:{request.remote_addr or '0.0.0.0'}"
 
 def uses_left() -> int:
     if session.get("pro"):
         return 9999
     key = usage_key()
     today = _today()
-    used = USAGE.get((key, today), 0)
-    try:
-        daily = int(os.environ.get("FREE_DAILY", str(FREE_DAILY)))
-    except Exception:
-        daily = FREE_DAILY
-    return max(daily - used, 0)
+    used = None
+    if redis_client is not None:
+        try:
+            used = int(redis_client.get(f"q:{key}:{today}") or 0)
+        except redis.RedisError:
+            pass  # Redis down: fall back to this process's counts
+    if used is None:
+        used = USAGE.get(today, {}).get(key, 0)
+    return max(FREE_DAILY - used, 0)
 
 def mark_use():
     if session.get("pro"):
         return
     key = usage_key()
     today = _today()
-    USAGE[(key, today)] = USAGE.get((key, today), 0) + 1
+    if redis_client is not None:
+        k = f"q:{key}:{today}"
+        try:
+            pipe = redis_client.pipeline()
+            pipe.incr(k)
+            pipe.expire(k, USAGE_TTL)
+            pipe.execute()
+            return
+        except redis.RedisError:
+            pass  # Redis down: count in memory rather than fail the request
+    with USAGE_LOCK:
+        day = USAGE.get(today)
+        if day is None:
+            if any(d > today for d in USAGE):
+                return  # request that started before midnight; its day is gone
+            USAGE.clear()
+            day = USAGE[today] = {}
+        day[key] = day.get(key, 0) + 1
 
 # -------------------------- STRIPE HELPERS --------------------------
 
+# Stripe lookups are 100-300 ms round-trips; cache them briefly.
+# TTLCache is not thread-safe, so access goes through STRIPE_CACHE_LOCK.
+STRIPE_CACHE_LOCK = threading.Lock()
+PRICE_CACHE = TTLCache(maxsize=8, ttl=3600)
+PRO_CACHE = TTLCache(maxsize=10_000, ttl=300)  # lowercased email -> bool
+
+@cached(PRICE_CACHE, lock=STRIPE_CACHE_LOCK)
+def get_price(price_id: str):
+    return stripe.Price.retrieve(price_id)
+
 def stripe_email_is_pro(user_email: str) -> bool:
     """
     True if the email has:
       - an ACTIVE subscription, OR
       - a Stripe Customer with metadata['lifetime_pro']=="true" (from one-time purchase).
+    Results are cached per email for a few minutes; lookup errors are not cached.
     """
     if not (STRIPE_SECRET_KEY and user_email):
         return False
+    email = user_email.lower()
+    # Lifetime buyers recorded by the webhook need no Stripe call. Checked before
+    # PRO_CACHE, which the webhook only clears in the worker that received it.
     try:
-        customers = stripe.Customer.search(query=f"email:'{user_email}'", limit=1)
-        if not customers.data:
-            return False
-        cust = customers.data[0]
-
-        # Lifetime flag from one-time checkout
-        meta = getattr(cust, "metadata", None) or {}
-        if str(meta.get("lifetime_pro", "")).lower() == "true":
+        if redis_client is not None and redis_client.exists(f"pro:{email}"):
             return True
-
-        # Any active subscription
-        subs = stripe.Subscription.list(customer=cust.id, status="active", limit=1)
-        return bool(subs and subs.data)
     except Exception:
+        pass
+    with STRIPE_CACHE_LOCK:
+        is_pro = PRO_CACHE.get(email)
+    if is_pro is not None:
+        return is_pro
+    try:
+        is_pro = _stripe_lookup_pro(email)
+    except Exception:
+        return False
+    with STRIPE_CACHE_LOCK:
+        PRO_CACHE[email] = is_pro
+    return is_pro
+
+def record_lifetime_pro(email: str, customer_id=None):
+    """
+    Record a one-time buyer: pro:<email> in Redis (if configured) and, when the
+    checkout created a Customer, metadata['lifetime_pro'] on it. Guest checkouts
+    have no Customer, so the email record is what makes them Pro.
+    """
+    if email:
+        email = email.lower()
+        if redis_client is not None:
+            redis_client.set(f"pro:{email}", "1")
+        with STRIPE_CACHE_LOCK:
+            PRO_CACHE.pop(email, None)
+    if customer_id:
+        # Stripe merges metadata keys on modify, so no retrieve is needed first
+        stripe.Customer.modify(customer_id, metadata={"lifetime_pro": "true"})
+
+def _stripe_lookup_pro(email: str) -> bool:
+    # Stripe search strings are single-quoted; backslash-escape \ and '
+    quoted = email.replace("\\", "\\\\").replace("'", "\\'")
+    customers = stripe.Customer.search(query=f"email:'{quoted}'", limit=1)
+    if not customers.data:
         return False
+    cust = customers.data[0]
+
+    # Lifetime flag from one-time checkout
+    meta = getattr(cust, "metadata", None) or {}
+    if str(meta.get("lifetime_pro", "")).lower() == "true":
+        return True
+
+    # Any active subscription
+    subs = stripe.Subscription.list(customer=cust.id, status="active", limit=1)
+    return bool(subs and subs.data)
+
+# -------------------------- STREAMED CARDS --------------------------
+
+# A streamed card finishes after the response headers (and so the session
+# cookie) are sent. Park it under a token that the next home() load claims.
+STREAMED_CARD_TTL = 600
+STREAMED_CARDS = TTLCache(maxsize=1024, ttl=STREAMED_CARD_TTL)  # used without Redis
+STREAMED_CARDS_LOCK = threading.Lock()
+# The card must be claimable by whichever worker serves the next GET /. Without
+# Redis that only holds for a single worker, so the page falls back to /generate.
+STREAMING_ENABLED = redis_client is not None or int(os.environ.get("WEB_CONCURRENCY", "1")) <= 1
+
+def stash_card(token: str, card: dict):
+    if redis_client is not None:
+        try:
+            redis_client.set(f"card:{token}", orjson.dumps(card), ex=STREAMED_CARD_TTL)
+            return
+        except redis.RedisError:
+            pass  # keep it locally; the claim may still land on this worker
+    with STREAMED_CARDS_LOCK:
+        STREAMED_CARDS[token] = card
+
+def claim_card(token: str):
+    if redis_client is not None:
+        try:
+            # GET + DELETE in one MULTI/EXEC (GETDEL needs Redis 6.2+)
+            pipe = redis_client.pipeline()
+            pipe.get(f"card:{token}")
+            pipe.delete(f"card:{token}")
+            raw, _ = pipe.execute()
+            if raw:
+                return orjson.loads(raw)
+        except redis.RedisError:
+            pass
+    with STREAMED_CARDS_LOCK:
+        return STREAMED_CARDS.pop(token, None)
+
+def sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
 
 # -------------------------- ROUTES --------------------------
 
 @app.route("/", methods=["GET"])
 def home():
-    session.setdefault("sid", str(uuid.uuid4()))
-    return render_template("index.html",
-                           categories=CATEGORIES,
-                           tones=TONES,
+    if "sid" not in session:
+        session["sid"] = secrets.token_hex(16)
+    token = session.pop("stream_token", None)
+    if token:
+        card = claim_card(token)
+        if card:
+            session["last_card"] = card
+    return render_template(INDEX_TEMPLATE, **INDEX_CTX,
                            remaining=uses_left(),
-                           last=session.get("last_card"),
-                           stripe=bool(STRIPE_PRICE_ID or STRIPE_LINK))
+                           last=session.get("last_card"))
 
 @app.route("/generate", methods=["POST"])
 def generate():
-    if uses_left() <= 0 and not session.get("pro"):
+    remaining = uses_left()
+    if remaining <= 0 and not session.get("pro"):
         flash("You’ve used today’s free cards. Upgrade for unlimited.", "error")
         return redirect(url_for("upgrade"))
 
-    category = request.form.get("category", "Trigger")
-    tone = request.form.get("tone", "Sassy")
-    theme = request.form.get("theme", "")
-    if category not in CATEGORIES:
-        category = "Trigger"
-
+    category, tone, theme = card_form()
     try:
         card = call_openai(category, theme, tone)
     except Exception as e:
@@ -213,13 +406,55 @@ def generate():
                 "body": f"OpenAI request failed: {e}", "category": category, "tags": ["error"]}
 
     mark_use()
+    if not session.get("pro"):
+        remaining = max(remaining - 1, 0)
     session["last_card"] = card
-    return render_template("index.html",
-                           categories=CATEGORIES,
-                           tones=TONES,
-                           remaining=uses_left(),
-                           last=card,
-                           stripe=bool(STRIPE_PRICE_ID or STRIPE_LINK))
+    return render_template(INDEX_TEMPLATE, **INDEX_CTX,
+                           remaining=remaining,
+                           last=card)
+
+@app.route("/generate/stream", methods=["POST"])
+def generate_stream():
+    """
+    Server-sent events variant of /generate used by the page's JS.
+    Emits `field` events as title/subtitle/body/category complete, then `card`.
+    Any non-200 makes the client fall back to a plain POST /generate.
+    """
+    if not STREAMING_ENABLED:
+        return "Streaming needs REDIS_URL when running more than one worker", 503
+    if uses_left() <= 0 and not session.get("pro"):
+        return "Daily limit reached", 429
+
+    category, tone, theme = card_form()
+    mark_use()
+    token = secrets.token_hex(16)
+    session["stream_token"] = token
+
+    def events():
+        try:
+            for event, data in stream_card(category, theme, tone):
+                if event == "card":
+                    stash_card(token, data)
+                yield sse(event, data)
+        except Exception as e:
+            card = {"title": "Network Error", "subtitle": "",
+                    "body": f"OpenAI request failed: {e}", "category": category, "tags": ["error"]}
+            stash_card(token, card)
+            yield sse("card", card)
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def card_form():
+    """(category, tone, theme) from the generator form, with unknown values reset."""
+    category = request.form.get("category", "Trigger")
+    tone = request.form.get("tone", "Sassy")
+    theme = request.form.get("theme", "")
+    if category not in CATEGORIES_SET:
+        category = "Trigger"
+    if tone not in TONES_SET:
+        tone = "Sassy"
+    return category, tone, theme
 
 # ---------- Upgrade (Payment) ----------
 
@@ -233,7 +468,7 @@ def buy():
     """
     if STRIPE_SECRET_KEY and STRIPE_PRICE_ID:
         try:
-            price = stripe.Price.retrieve(STRIPE_PRICE_ID)
+            price = get_price(STRIPE_PRICE_ID)
             is_recurring = bool(getattr(price, "recurring", None))
 
             checkout_kwargs = dict(
@@ -280,7 +515,8 @@ def pro():
       - Requires a valid Stripe Checkout session_id
       - Must match the same device's pending_checkout_id
       - Verifies payment_status == 'paid'
-      - If one-time, marks lifetime_pro on the Stripe Customer
+      - If one-time and no webhook is configured, marks lifetime_pro on the Stripe Customer
+        (otherwise /stripe/webhook does it off the user-facing path)
       - Saves email for login restoration
     """
     sid = request.args.get("session_id")
@@ -314,17 +550,18 @@ def pro():
         session.permanent = True
         session["pro"] = True
 
-        # Tag lifetime for one-time purchases
-        if getattr(chk, "mode", None) == "payment" and getattr(chk, "customer", None):
-            cust_id = chk.customer.id if hasattr(chk.customer, "id") else chk.customer
-            cust = stripe.Customer.retrieve(cust_id)
-            meta = (getattr(cust, "metadata", None) or {}).copy()
-            meta["lifetime_pro"] = "true"
-            stripe.Customer.modify(cust_id, metadata=meta)
-
         # Remember email locally
+        checkout_email = ""
         if getattr(chk, "customer_details", None) and chk.customer_details.get("email"):
-            session["email"] = chk.customer_details["email"].lower()
+            checkout_email = session["email"] = chk.customer_details["email"].lower()
+            with STRIPE_CACHE_LOCK:
+                PRO_CACHE.pop(checkout_email, None)
+
+        # Tag lifetime for one-time purchases
+        if not STRIPE_WEBHOOK_SECRET and getattr(chk, "mode", None) == "payment":
+            cust = getattr(chk, "customer", None)
+            cust_id = cust.id if hasattr(cust, "id") else cust
+            record_lifetime_pro(checkout_email, cust_id)
 
         # Success; clear pending id
         session.pop("pending_checkout_id", None)
@@ -336,13 +573,41 @@ def pro():
         flash(f"Stripe verification failed: {e}", "error")
         return redirect(url_for("upgrade"))
 
+@app.route("/stripe/webhook", methods=["POST"])
+def stripe_webhook():
+    """
+    Stripe webhook for checkout.session.completed.
+    Tags one-time buyers as lifetime Pro so /pro doesn't have to do it inline.
+    """
+    if not (STRIPE_SECRET_KEY and STRIPE_WEBHOOK_SECRET):
+        return "not configured", 404
+    try:
+        event = stripe.Webhook.construct_event(
+            request.get_data(), request.headers.get("Stripe-Signature", ""), STRIPE_WEBHOOK_SECRET
+        )
+    except (ValueError, stripe.error.SignatureVerificationError):
+        return "bad signature", 400
+
+    if event["type"] == "checkout.session.completed":
+        chk = event["data"]["object"]
+        if chk.get("mode") == "payment" and chk.get("payment_status") == "paid":
+            email = (chk.get("customer_details") or {}).get("email") or ""
+            try:
+                record_lifetime_pro(email, chk.get("customer"))
+            except Exception:
+                return "retry", 500  # Stripe retries failed deliveries
+    return "", 200
+
 # ---------- Email sign-in for cross-device Pro ----------
 
+# Cheap sanity check before the email reaches Redis/Stripe
+EMAIL_RE = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+
 @app.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         email = (request.form.get("email") or "").strip().lower()
-        if not email:
+        if not EMAIL_RE.match(email):
             flash("Please enter a valid email.", "error")
             return redirect(url_for("login"))
         session.permanent = True
@@ -0,0 +1,47 @@
+"""
+Card JSON parsing, kept in its own strictly-typed module so it can be
+compiled with mypyc (`mypyc parsing.py`). app.py imports whichever is
+present: the compiled extension or this source file.
+"""
+import re
+from typing import Any
+
+import orjson
+
+# Fallback for replies wrapped in ```json fences or surrounded by chatter
+_FENCE_RE = re.compile(r"^```(?:json)?|```$")
+_OBJ_RE = re.compile(r"\{.*\}", re.DOTALL)
+
+def _fill_card(data: dict[str, Any]) -> dict[str, Any]:
+    data.setdefault("category", "Trigger")
+    data.setdefault("tags", [])
+    for k in ("title", "subtitle", "body"):
+        data.setdefault(k, "")
+    return data
+
+def parse_json_safe(text: str) -> dict[str, Any]:
+    """Extract first JSON object from text safely."""
+    text = text.strip()
+    # Fast path: with response_format=json_object the reply is bare JSON.
+    try:
+        data = orjson.loads(text)
+        if isinstance(data, dict):
+            return _fill_card(data)
+    except ValueError:
+        pass
+
+    text = _FENCE_RE.sub("", text).strip()
+    match = _OBJ_RE.search(text)
+    if not match:
+        return {"title": "Card Error", "subtitle": "Parsing issue",
+                "body": "We couldn't parse the AI response as JSON. Try again.",
+                "category": "Trigger", "tags": ["error"]}
+    try:
+        data = orjson.loads(match.group(0))
+    except ValueError:
+        data = None
+    if not isinstance(data, dict):
+        return {"title": "Card Error", "subtitle": "JSON decode failed",
+                "body": "The response wasn't valid JSON. Try again.",
+                "category": "Trigger", "tags": ["error"]}
+    return _fill_card(data)